@@ -1,9 +1,161 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime
 import io
 import xlwt
 
+# Store text columns as Arrow-backed strings rather than Python objects
+# (already the default from pandas 3)
+pd.set_option('future.infer_string', True)
+
+# Column mapping: Template column -> Source column name
+COLUMN_MAPPING = {
+    'PPID': 'Pim Parent ID',
+    'SKU': 'Retek ID',
+    'BARCODE': 'Barcode',
+    'DESCRIPTION': 'Retek Item Description',
+    'COLOUR': 'Diff 1 Description',
+    'SIZE': 'UK Size Concat',
+    'PRODUCT TYPE': 'Product Type UDA',
+    'DIVISION': 'Division Name',
+    'BRAND': 'Brand',
+    'DEPARTMENT': 'Department Name',
+    'DEPARTMENT NUMBER': 'Department Number',
+    'DIVISION NUMBER': 'Division Number',
+    'STORE 301 ALLOCATION': 'Store 301 Allocation',
+    'STORE 401 ALLOCATION': 'Store 401 Allocation',
+    'ITEM STORE FLAG': 'Item Store Flag',
+    'VPN PARENT': 'VPN Parent'
+}
+
+# Lower-cased source column names, for case-insensitive matching
+NEEDED_SOURCE_COLUMNS = {col.lower() for col in COLUMN_MAPPING.values()}
+
+
+# Output template columns, in file order
+OUTPUT_COLUMNS = ['PPID', 'SKU', 'BARCODE', 'DESCRIPTION', 'COLOUR', 'SIZE',
+                  'PRODUCT TYPE', 'DIVISION', 'BRAND', 'DEPARTMENT',
+                  'DEPARTMENT NUMBER', 'DIVISION NUMBER', 'STORE 301 ALLOCATION',
+                  'STORE 401 ALLOCATION', 'ITEM STORE FLAG', 'VPN PARENT']
+
+
+def is_needed_column(col):
+    """Keep only source columns used in the output (plus the PPID column) when reading."""
+    name = str(col).lower()
+    return name in NEEDED_SOURCE_COLUMNS or 'pim parent id' in name
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def get_sheet_names(file_bytes):
+    """List the workbook's sheets, opening the upload once per file rather than on every rerun."""
+    with pd.ExcelFile(io.BytesIO(file_bytes), engine="calamine") as xls:
+        return xls.sheet_names
+
+
+def read_sheet(file_bytes, sheet_name):
+    """Read source sheet(s) from the upload bytes, parsing only the needed columns."""
+    return pd.read_excel(io.BytesIO(file_bytes), sheet_name=sheet_name, usecols=is_needed_column,
+                         engine="calamine")
+
+
+def write_xls(output_df):
+    """Serialize the output frame to .xls bytes using xlwt."""
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet('Processed Data')
+    
+    # Write headers
+    for col_idx, col_name in enumerate(OUTPUT_COLUMNS):
+        sheet.write(0, col_idx, col_name)
+    
+    # Blank out missing values for the whole frame up front, as an object array
+    # of plain Python values xlwt can write directly
+    data = output_df[OUTPUT_COLUMNS]
+    values = data.to_numpy(dtype=object)
+    values[data.isna().to_numpy()] = ''
+    
+    # Write data, flushing finished rows to xlwt's temp file every
+    # 1000 rows so their per-cell objects are freed as the sheet grows
+    for row_idx, row in enumerate(values, start=1):
+        for col_idx, value in enumerate(row):
+            sheet.write(row_idx, col_idx, value)
+        if row_idx % 1000 == 0:
+            sheet.flush_row_data()
+    
+    # Save to buffer
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+# Repeat hits only come from reruns of the current session, so keep a few entries
+@st.cache_data(show_spinner=False, max_entries=8)
+def process_file(file_bytes, source_sheets):
+    """Build the output file from the selected sheets of an uploaded workbook.
+    
+    Cached on the file contents and sheet selection, so Streamlit reruns reuse the
+    result instead of re-parsing and re-processing the workbook.
+    Returns (sheet_rows, ppid_col, output_df, mapping_status, xls_bytes); all but
+    sheet_rows are None when no Pim Parent ID column is found.
+    """
+    # Read all source sheets in a single pass over the workbook
+    source_frames = read_sheet(file_bytes, source_sheets)
+    sheet_rows = {sheet: len(df) for sheet, df in source_frames.items()}
+    
+    # Combine all source data
+    all_source = pd.concat(source_frames.values(), ignore_index=True)
+    
+    # Lower-case the column names once for case-insensitive matching
+    lower_columns = all_source.columns.astype(str).str.lower()
+    
+    # Find Pim Parent ID column
+    ppid_matches = all_source.columns[lower_columns.str.contains('pim parent id', regex=False)]
+    if len(ppid_matches) == 0:
+        return sheet_rows, None, None, None, None
+    ppid_col = ppid_matches[0]
+    
+    # Resolve each template column's source column once (case-insensitive) through
+    # a lower-cased name lookup, keeping the first match for each name
+    source_lookup = {}
+    for col, lower_col in zip(all_source.columns, lower_columns):
+        source_lookup.setdefault(lower_col, col)
+    present = {
+        template_col: source_lookup[source_col.lower()]
+        for template_col, source_col in COLUMN_MAPPING.items()
+        if template_col != 'PPID' and source_col.lower() in source_lookup
+    }
+    
+    # One row per PPID holding the first non-null value of every mapped column,
+    # in a single hashed group-by pass (PPIDs keep their order of first appearance)
+    output_df = all_source.groupby(ppid_col, sort=False)[list(present.values())].first()
+    
+    # Relabel the per-PPID result in place with the template names, so neither
+    # the source nor the result is copied just to rename columns
+    output_df.columns = list(present)
+    output_df.index.name = 'PPID'
+    output_df = output_df.reset_index().reindex(columns=OUTPUT_COLUMNS)
+    
+    # BARCODE - convert to integer (remove decimals) in one column pass,
+    # leaving values that are not numbers as they are
+    barcodes = pd.to_numeric(output_df['BARCODE'], errors='coerce')
+    is_number = np.isfinite(barcodes)
+    output_df['BARCODE'] = output_df['BARCODE'].astype(object)
+    output_df.loc[is_number, 'BARCODE'] = barcodes[is_number].astype('int64').astype(object)
+    
+    # Column mapping status
+    mapping_status = []
+    for template_col, source_col in COLUMN_MAPPING.items():
+        found = source_col.lower() in source_lookup
+        status = "✅ Found" if found else "❌ Not Found"
+        mapping_status.append({
+            'Template Column': template_col,
+            'Source Column': source_col,
+            'Status': status
+        })
+    
+    return sheet_rows, ppid_col, output_df, mapping_status, write_xls(output_df)
+
+
 st.set_page_config(page_title="Brown Thomas File Processor", layout="wide")
 
 st.title("Brown Thomas Manual Transfer File Processor")
@@ -14,9 +166,9 @@ uploaded_file = st.file_uploader("Upload your XLS file", type=['xls', 'xlsx'])
 
 if uploaded_file is not None:
     try:
-        # Read all sheets from the Excel file
-        xls = pd.ExcelFile(uploaded_file)
-        sheet_names = xls.sheet_names
+        # List the sheets in the Excel file
+        file_bytes = uploaded_file.getvalue()
+        sheet_names = get_sheet_names(file_bytes)
         
         st.info(f"Found {len(sheet_names)} sheets: {', '.join(sheet_names)}")
         
@@ -34,98 +186,17 @@ if uploaded_file is not None:
         
         if st.button("Process File", type="primary"):
             with st.spinner("Processing..."):
-                # Read source sheets
-                source_dfs = []
-                for sheet in source_sheets:
-                    df = pd.read_excel(uploaded_file, sheet_name=sheet)
-                    source_dfs.append(df)
-                    st.write(f"**{sheet}** - {len(df)} rows")
-                
-                # Combine all source data
-                all_source = pd.concat(source_dfs, ignore_index=True)
-                
-                # Column mapping: Template column -> Source column name
-                column_mapping = {
-                    'PPID': 'Pim Parent ID',
-                    'SKU': 'Retek ID',
-                    'BARCODE': 'Barcode',
-                    'DESCRIPTION': 'Retek Item Description',
-                    'COLOUR': 'Diff 1 Description',
-                    'SIZE': 'UK Size Concat',
-                    'PRODUCT TYPE': 'Product Type UDA',
-                    'DIVISION': 'Division Name',
-                    'BRAND': 'Brand',
-                    'DEPARTMENT': 'Department Name',
-                    'DEPARTMENT NUMBER': 'Department Number',
-                    'DIVISION NUMBER': 'Division Number',
-                    'STORE 301 ALLOCATION': 'Store 301 Allocation',
-                    'STORE 401 ALLOCATION': 'Store 401 Allocation',
-                    'ITEM STORE FLAG': 'Item Store Flag',
-                    'VPN PARENT': 'VPN Parent'
-                }
-                
-                # Find Pim Parent ID column
-                ppid_col = None
-                for col in all_source.columns:
-                    if 'pim parent id' in col.lower():
-                        ppid_col = col
-                        break
+                sheet_rows, ppid_col, output_df, mapping_status, output = process_file(
+                    file_bytes, source_sheets
+                )
+                for sheet, rows in sheet_rows.items():
+                    st.write(f"**{sheet}** - {rows} rows")
                 
                 if ppid_col is None:
                     st.error("Could not find 'Pim Parent ID' column in source sheets!")
                 else:
                     st.success(f"Found Pim Parent ID column: '{ppid_col}'")
-                    
-                    # Get unique PPIDs
-                    unique_ppids = all_source[ppid_col].dropna().unique()
-                    st.info(f"Found {len(unique_ppids)} unique PPIDs")
-                    
-                    # Create output
-                    output_data = []
-                    
-                    for ppid in unique_ppids:
-                        matching_rows = all_source[all_source[ppid_col] == ppid]
-                        
-                        row_data = {'PPID': ppid}
-                        
-                        for template_col, source_col in column_mapping.items():
-                            if template_col == 'PPID':
-                                continue
-                            
-                            # Find source column (case-insensitive)
-                            source_col_actual = None
-                            for col in all_source.columns:
-                                if col.lower() == source_col.lower():
-                                    source_col_actual = col
-                                    break
-                            
-                            if source_col_actual:
-                                values = matching_rows[source_col_actual].dropna()
-                                if len(values) > 0:
-                                    value = values.iloc[0]
-                                    
-                                    # BARCODE - convert to integer (remove decimals)
-                                    if template_col == 'BARCODE' and pd.notna(value):
-                                        try:
-                                            value = int(float(value))
-                                        except (ValueError, TypeError):
-                                            pass
-                                    
-                                    row_data[template_col] = value
-                                else:
-                                    row_data[template_col] = None
-                            else:
-                                row_data[template_col] = None
-                        
-                        output_data.append(row_data)
-                    
-                    # Create output dataframe with correct column order
-                    output_columns = ['PPID', 'SKU', 'BARCODE', 'DESCRIPTION', 'COLOUR', 'SIZE', 
-                                     'PRODUCT TYPE', 'DIVISION', 'BRAND', 'DEPARTMENT', 
-                                     'DEPARTMENT NUMBER', 'DIVISION NUMBER', 'STORE 301 ALLOCATION', 
-                                     'STORE 401 ALLOCATION', 'ITEM STORE FLAG', 'VPN PARENT']
-                    
-                    output_df = pd.DataFrame(output_data, columns=output_columns)
+                    st.info(f"Found {len(output_df)} unique PPIDs")
                     
                     st.success(f"✅ Created {len(output_df)} rows in output file")
                     
@@ -137,28 +208,6 @@ if uploaded_file is not None:
                     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                     output_filename = f"Processed_Manual_Transfer_File_{timestamp}.xls"
                     
-                    # Create .xls file using xlwt
-                    workbook = xlwt.Workbook()
-                    sheet = workbook.add_sheet('Processed Data')
-                    
-                    # Write headers
-                    for col_idx, col_name in enumerate(output_columns):
-                        sheet.write(0, col_idx, col_name)
-                    
-                    # Write data
-                    for row_idx, row in output_df.iterrows():
-                        for col_idx, col_name in enumerate(output_columns):
-                            value = row[col_name]
-                            if pd.isna(value):
-                                sheet.write(row_idx + 1, col_idx, '')
-                            else:
-                                sheet.write(row_idx + 1, col_idx, value)
-                    
-                    # Save to buffer
-                    output = io.BytesIO()
-                    workbook.save(output)
-                    output.seek(0)
-                    
                     st.download_button(
                         label="📥 Download Processed File",
                         data=output,
@@ -170,7 +219,7 @@ if uploaded_file is not None:
                     st.subheader("Processing Summary")
                     col1, col2, col3 = st.columns(3)
                     with col1:
-                        st.metric("Total Unique PPIDs", len(unique_ppids))
+                        st.metric("Total Unique PPIDs", len(output_df))
                     with col2:
                         st.metric("Output Rows", len(output_df))
                     with col3:
@@ -178,15 +227,6 @@ if uploaded_file is not None:
                     
                     # Show column mapping status
                     st.subheader("Column Mapping Status")
-                    mapping_status = []
-                    for template_col, source_col in column_mapping.items():
-                        found = any(col.lower() == source_col.lower() for col in all_source.columns)
-                        status = "✅ Found" if found else "❌ Not Found"
-                        mapping_status.append({
-                            'Template Column': template_col,
-                            'Source Column': source_col,
-                            'Status': status
-                        })
                     st.dataframe(pd.DataFrame(mapping_status))
                         
     except Exception as e: